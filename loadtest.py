@@ -0,0 +1,256 @@
+"""Concurrent-session load test for pmg.py.
+
+Simulates N Streamlit sessions browsing chapters and saving notes against a
+local corpus, using Streamlit's AppTest to drive real reruns of the script.
+AppTest keeps a process-wide runtime and is not safe to drive from several
+threads, so each session runs in its own process. SQLite contention is the
+same as under `streamlit run` (one connection per session, one shared
+file). A real server runs every session in one process with one GIL, one
+lru_cache and one heap. To approximate the shared GIL, all session
+processes are pinned to one CPU core by default (--cores). Caches and heap
+are still per process, so latency here is a lower bound and the session
+count at which the app degrades is an upper bound.
+
+Usage:
+    python loadtest.py --sessions 1,5,10,20 --actions 30
+    python loadtest.py --corpus data/preach_my_gospel_db.json --sessions 50
+
+For each session count it reports p50/p95/p99 rerun latency, SQLite lock
+errors, other app errors, sessions that crashed or never reported, the
+resident memory each session holds after its reruns, and peak RSS per
+session process. Latency is measured with no memory tracing active.
+"""
+import argparse, gc, hashlib, json, math, os, queue, random, resource, shutil, sys, tempfile, threading, time
+import multiprocessing as mp
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pmg.py")
+SAVE_PROBABILITY = 0.3
+RUN_TIMEOUT = 60
+START_TIMEOUT = 120  # seconds for every session process to import the app and warm up
+
+def build_corpus(n_chapters, n_sections, n_paragraphs, seed=0):
+    """Build a synthetic corpus in the same format the scraper writes."""
+    rng = random.Random(seed)
+    words = ["faith", "repentance", "baptism", "spirit", "covenant", "prayer", "scripture", "gospel",
+             "savior", "atonement", "restoration", "prophet", "teach", "invite", "commitment", "charity"]
+    paragraphs, chapters = {}, []
+    for ci in range(n_chapters):
+        sections = []
+        for si in range(n_sections):
+            refs = []
+            for _ in range(n_paragraphs):
+                text = " ".join(rng.choices(words, k=rng.randint(40, 120))).capitalize() + ". See Alma 32:21."
+                h = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+                paragraphs[h] = text
+                refs.append(h)
+            sections.append({"heading": f"Section {ci + 1}.{si + 1}", "paragraphs": refs})
+        chapters.append({"url": f"https://example.invalid/chapter-{ci}", "title": f"Chapter {ci + 1}", "sections": sections})
+    return {"source": "loadtest", "scraped_at": time.asctime(), "chapters": chapters, "paragraphs": paragraphs}
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+class SessionResult:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.latencies = []
+        self.lock_errors = 0
+        self.errors = []
+        self.rss_held_mb = 0.0
+        self.peak_rss_mb = 0.0
+
+def max_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def current_rss_mb():
+    """Current resident set size in MB, falling back to the peak where /proc is unavailable."""
+    gc.collect()
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return max_rss_mb()
+
+def pinned_cpus(cores):
+    """The first `cores` CPUs this process may run on, or None when not pinning."""
+    if cores <= 0 or not hasattr(os, "sched_getaffinity"):
+        return None
+    return sorted(os.sched_getaffinity(0))[:cores]
+
+def timed_run(at, result):
+    """Rerun the app once, recording latency and any errors it rendered."""
+    start = time.perf_counter()
+    at.run(timeout=RUN_TIMEOUT)
+    result.latencies.append(time.perf_counter() - start)
+    for el in list(at.error) + list(at.exception):
+        message = str(getattr(el, "value", None) or getattr(el, "message", ""))
+        if "locked" in message or "busy" in message:
+            result.lock_errors += 1
+        else:
+            result.errors.append(message)
+
+def run_session(session_id, corpus, actions, start_barrier, seed, results, cpus=None):
+    """Drive one session: pick chapters and sections at random, sometimes saving notes."""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    rng = random.Random(seed)
+    result = SessionResult(session_id)
+    at = AppTest.from_file(APP_PATH, default_timeout=RUN_TIMEOUT)
+    at.session_state["user_id"] = f"loadtest-{session_id}"
+    try:
+        # Import the app's dependencies before measuring, so they are not charged to the session.
+        # The second run renders the analytics charts, which import their plotting stack lazily.
+        at.run(timeout=RUN_TIMEOUT)
+        at.run(timeout=RUN_TIMEOUT)
+    except Exception as e:
+        actions = 0
+        result.errors.append(f"warm-up failed: {type(e).__name__}: {e}")
+    try:
+        start_barrier.wait(timeout=START_TIMEOUT)
+    except threading.BrokenBarrierError:
+        result.errors.append("start barrier broken: another session failed to start")
+    rss_before = current_rss_mb()
+    try:
+        timed_run(at, result)
+        for _ in range(actions):
+            ci = rng.randrange(len(corpus["chapters"]))
+            si = rng.randrange(len(corpus["chapters"][ci]["sections"]))
+            at.selectbox(key="chapter_select").set_value(ci)
+            timed_run(at, result)
+            at.selectbox(key=f"section_select_{ci}").set_value(si)
+            timed_run(at, result)
+            if rng.random() < SAVE_PROBABILITY:
+                at.text_area(key=f"notes_{ci}_{si}").input(f"note from session {session_id} at {time.time()}")
+                at.button(key=f"save_{ci}_{si}").click()
+                timed_run(at, result)
+    except Exception as e:
+        result.errors.append(f"{type(e).__name__}: {e}")
+    result.rss_held_mb = current_rss_mb() - rss_before
+    result.peak_rss_mb = max_rss_mb()
+    results.put(result.__dict__)
+
+def run_level(n_sessions, corpus, actions, seed, cpus=None):
+    """Run n concurrent sessions and summarize latency, errors, failures and memory."""
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(n_sessions + 1)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=run_session, args=(i, corpus, actions, barrier, seed + i, results, cpus)) for i in range(n_sessions)]
+    for proc in procs:
+        proc.start()
+    try:
+        barrier.wait(timeout=START_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass  # sessions that did start carry on; the missing ones are reported below
+    started = time.perf_counter()
+    # Every rerun may take up to RUN_TIMEOUT; a session does at most three per action plus the first.
+    deadline = time.monotonic() + RUN_TIMEOUT * (3 * actions + 2)
+    outcomes = {}
+    while len(outcomes) < n_sessions and time.monotonic() < deadline:
+        try:
+            r = results.get(timeout=1)
+            outcomes[r["session_id"]] = r
+        except queue.Empty:
+            if not any(proc.is_alive() for proc in procs) and results.empty():
+                break
+    elapsed = time.perf_counter() - started
+    failures = []
+    for i, proc in enumerate(procs):
+        if i in outcomes:
+            proc.join()
+            continue
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+            failures.append(f"session {i}: no result before the deadline")
+        else:
+            failures.append(f"session {i}: process exited with code {proc.exitcode}")
+    done = list(outcomes.values())
+    latencies = [x for r in done for x in r["latencies"]]
+    errors = failures + [e for r in done for e in r["errors"]]
+    return {
+        "sessions": n_sessions,
+        "failed_sessions": len(failures),
+        "reruns": len(latencies),
+        "reruns_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "lock_errors": sum(r["lock_errors"] for r in done),
+        "other_errors": len(errors) - len(failures),
+        "sample_error": errors[0] if errors else "",
+        "rss_held_per_session_mb": sum(r["rss_held_mb"] for r in done) / len(done) if done else 0.0,
+        "peak_rss_per_process_mb": sum(r["peak_rss_mb"] for r in done) / len(done) if done else 0.0,
+    }
+
+def print_report(report):
+    """Print the run conditions, then one line per session count."""
+    rows = report["levels"]
+    pinned = report["pinned_cpus"]
+    print(f"CPU cores: {report['cpu_cores']}; sessions pinned to "
+          + (f"{len(pinned)} core(s) {pinned}" if pinned else "no cores (free to spread out)") + ".")
+    print("Each session runs in its own process, so latency is a lower bound and the sustainable\n"
+          "session count an upper bound compared with one `streamlit run` server.\n")
+    header = f"{'sessions':>8} {'failed':>6} {'reruns':>7} {'rerun/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'locks':>6} {'errors':>6} {'MB held':>8} {'peak RSS':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['sessions']:>8} {r['failed_sessions']:>6} {r['reruns']:>7} {r['reruns_per_sec']:>8.1f} {r['p50_ms']:>8.0f} {r['p95_ms']:>8.0f} "
+              f"{r['p99_ms']:>8.0f} {r['lock_errors']:>6} {r['other_errors']:>6} {r['rss_held_per_session_mb']:>8.2f} {r['peak_rss_per_process_mb']:>8.0f}")
+    for r in rows:
+        if r["sample_error"]:
+            print(f"[{r['sessions']} sessions] first error: {r['sample_error'][:200]}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,5,10,20", help="Comma-separated concurrent session counts to sweep.")
+    parser.add_argument("--actions", type=int, default=20, help="Navigation steps per session.")
+    parser.add_argument("--corpus", help="Existing corpus JSON to test against (default: synthetic).")
+    parser.add_argument("--chapters", type=int, default=15)
+    parser.add_argument("--sections", type=int, default=12)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cores", type=int, default=1,
+                        help="Pin all session processes to this many CPU cores to approximate one server process (0: no pinning).")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON instead of a table.")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            corpus = json.load(f)
+    else:
+        corpus = build_corpus(args.chapters, args.sections, args.paragraphs, args.seed)
+
+    # pmg.py resolves data/ relative to the working directory; give each run a fresh one.
+    workdir = tempfile.mkdtemp(prefix="pmg-loadtest-")
+    cwd = os.getcwd()
+    cpus = pinned_cpus(args.cores)
+    rows = []
+    try:
+        os.chdir(workdir)
+        for n in [int(x) for x in args.sessions.split(",") if x.strip()]:
+            shutil.rmtree("data", ignore_errors=True)
+            os.makedirs("data")
+            with open(os.path.join("data", "preach_my_gospel_db.json"), "w", encoding="utf-8") as f:
+                json.dump(corpus, f, ensure_ascii=False)
+            rows.append(run_level(n, corpus, args.actions, args.seed, cpus))
+            print(f"finished {n} sessions", file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"cpu_cores": os.cpu_count(), "pinned_cpus": cpus, "levels": rows}
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
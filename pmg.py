@@ -2,11 +2,13 @@ import streamlit as st
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
-import time, os, json, re, sqlite3
+import time, os, json, re, sqlite3, csv, io, sys, argparse, hashlib, math, difflib
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from collections import Counter
 import nltk
+import numpy as np
 from functools import lru_cache
 
 # === Configuration ===
@@ -17,8 +19,14 @@ RATE_LIMIT_SECONDS = 0.7
 DATA_DIR = "data"
 DB_JSON = os.path.join(DATA_DIR, "preach_my_gospel_db.json")
 SQLITE_FILE = os.path.join(DATA_DIR, "progress.sqlite3")
+BOILERPLATE_MIN_CHAPTERS = 3
+BOILERPLATE_CHAPTER_RATIO = 0.5
+MAX_SECTION_SECONDS = 30 * 60  # cap on time credited to one section visit (idle tabs)
+REVISION_KEYFRAME_INTERVAL = 10  # store a full paragraph list every N revisions of a section
+RELATED_TOP_K = 5
+TFIDF_MAX_DF = 0.5  # terms in more than this share of sections are ignored for similarity
 
-# === NLTK Setup (for robustness, though not used) ===
+# === NLTK Setup ===
 def ensure_nltk_resources():
     """Ensure NLTK resources are downloaded."""
     try:
@@ -27,14 +35,8 @@ def ensure_nltk_resources():
         st.info("Downloading NLTK 'punkt_tab' resource...")
         nltk.download("punkt_tab", quiet=True)
 
-# Initialize NLTK resources
-try:
-    ensure_nltk_resources()
-except Exception as e:
-    st.error(f"Failed to initialize NLTK resources: {e}. Functionality unaffected as NLTK is not used.")
-
 # === Enhanced CSS with Updated Styles ===
-st.markdown("""
+APP_CSS = """
 <style>
     /* Global Styles */
     .stApp {
@@ -416,7 +418,7 @@ st.markdown("""
         }
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # === Utilities ===
 def is_allowed_url(url: str) -> bool:
@@ -494,6 +496,8 @@ def scrape_chapter(url: str):
             for el in tag.find_all_next():
                 if el.name and el.name.startswith("h") and el.name <= tag.name:
                     break
+                if el.name == "div" and el.find(["p", "li", "div"]):
+                    continue  # container; its children are collected individually
                 if el.name in ("p", "li", "div"):
                     t = el.get_text(" ", strip=True)
                     if t and len(t) > 10:
@@ -523,6 +527,170 @@ def scrape_chapters_concurrent(links):
                 st.error(f"Failed to scrape {title}: {e}")
     return chapters
 
+# === Corpus Deduplication ===
+def paragraph_hash(text):
+    """Content hash of a paragraph, insensitive to whitespace differences."""
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()[:16]
+
+def section_hash(heading, paragraph_hashes):
+    """Content hash of a section from its heading and ordered paragraph hashes."""
+    key = (heading or "") + "\n" + "\n".join(paragraph_hashes)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+def section_content_hash(section):
+    """Return a section's content hash, computing it for corpora scraped before hashing."""
+    if section.get("hash"):
+        return section["hash"]
+    refs = section.get("paragraphs")
+    if refs is None:
+        refs = [paragraph_hash(p) for p in section.get("text", "").split("\n\n") if p.strip()]
+    return section_hash(section.get("heading"), refs)
+
+def dedupe_chapters(chapters):
+    """Strip cross-chapter boilerplate and store identical paragraphs once, by hash.
+
+    A paragraph that appears in at least BOILERPLATE_CHAPTER_RATIO of all
+    chapters (and no fewer than BOILERPLATE_MIN_CHAPTERS) is treated as
+    navigation/footer text and dropped. Sections then reference the
+    remaining paragraphs by hash. A section left with no paragraphs is kept
+    as an empty placeholder so that later section indexes, which progress
+    rows are keyed by, do not shift. Returns (chapters, paragraphs, stripped).
+    """
+    hashed_chapters = []
+    chapter_counts = Counter()
+    for ch in chapters:
+        hashed_sections = []
+        seen = set()
+        for sec in ch.get("sections", []):
+            paras = [p.strip() for p in sec.get("text", "").split("\n\n") if p.strip()]
+            hashed = [(paragraph_hash(p), p) for p in paras]
+            hashed_sections.append(hashed)
+            seen.update(h for h, _ in hashed)
+        chapter_counts.update(seen)
+        hashed_chapters.append(hashed_sections)
+
+    threshold = max(BOILERPLATE_MIN_CHAPTERS, math.ceil(len(chapters) * BOILERPLATE_CHAPTER_RATIO))
+    boilerplate = {h for h, n in chapter_counts.items() if n >= threshold}
+
+    paragraphs = {}
+    deduped = []
+    for ch, hashed_sections in zip(chapters, hashed_chapters):
+        sections = []
+        for sec, hashed in zip(ch.get("sections", []), hashed_sections):
+            refs = []
+            for h, p in hashed:
+                if h in boilerplate:
+                    continue
+                paragraphs.setdefault(h, p)
+                refs.append(h)
+            sections.append({"heading": sec.get("heading"), "hash": section_hash(sec.get("heading"), refs),
+                             "paragraphs": refs})
+        deduped.append({**{k: v for k, v in ch.items() if k != "sections"}, "sections": sections})
+    return deduped, paragraphs, len(boilerplate)
+
+def section_text(db, section):
+    """Return a section's text, resolving paragraph hashes when present."""
+    if "paragraphs" in section:
+        store = db.get("paragraphs", {})
+        return "\n\n".join(store.get(h, "") for h in section["paragraphs"])
+    return section.get("text", "")
+
+# === Related Sections ===
+def tokenize(text):
+    """Lowercase word tokens for indexing, using NLTK's punkt tokenizer when available."""
+    try:
+        tokens = nltk.word_tokenize(text.lower())
+    except LookupError:
+        tokens = re.findall(r"[a-z]+", text.lower())
+    return [t for t in tokens if t.isalpha() and len(t) > 2]
+
+def load_section_terms(conn, hashes):
+    """Return cached term counts for the given section hashes."""
+    c = conn.cursor()
+    cached = {}
+    hashes = list(set(hashes))
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        c.execute(f"SELECT hash, terms FROM section_terms WHERE hash IN ({', '.join('?' * len(chunk))})", chunk)
+        cached.update((h, json.loads(terms)) for h, terms in c.fetchall())
+    return cached
+
+def save_section_terms(conn, terms_by_hash):
+    """Cache term counts by section hash."""
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO section_terms (hash, terms) VALUES (?, ?)",
+                         ((h, json.dumps(terms, ensure_ascii=False, separators=(",", ":"))) for h, terms in terms_by_hash.items()))
+
+def build_related_index(chapters, paragraphs, conn=None, top_k=RELATED_TOP_K):
+    """Attach the top-k related sections to every section, in place.
+
+    Term counts are cached in the section_terms table by section content
+    hash, outside the corpus JSON, so only sections of changed chapters are
+    re-tokenized on re-scrape. Similarity is cosine over sublinear TF-IDF
+    weights, accumulated one section at a time from an inverted index, so
+    memory stays linear in the number of sections. Returns the number of
+    sections whose term counts came from the cache.
+    """
+    docs = [(ch.get("url"), idx, sec, section_content_hash(sec))
+            for ch in chapters for idx, sec in enumerate(ch.get("sections", []))]
+    cached = load_section_terms(conn, [h for _, _, _, h in docs]) if conn else {}
+    store = {"paragraphs": paragraphs}
+    fresh = {}
+    doc_terms = []
+    for _, _, sec, h in docs:
+        if h in cached:
+            terms = cached[h]
+        elif h in fresh:
+            terms = fresh[h]
+        else:
+            terms = fresh[h] = dict(Counter(tokenize(section_text(store, sec))))
+        doc_terms.append(terms)
+    if conn and fresh:
+        save_section_terms(conn, fresh)
+    reused = sum(1 for _, _, _, h in docs if h in cached)
+
+    n = len(docs)
+    postings = {}
+    for d, terms in enumerate(doc_terms):
+        for term, count in terms.items():
+            ids, counts = postings.setdefault(term, ([], []))
+            ids.append(d)
+            counts.append(count)
+
+    max_df = max(2, int(n * TFIDF_MAX_DF))
+    norms = np.zeros(n)
+    index = []
+    for ids, counts in postings.values():
+        ids = np.asarray(ids)
+        weights = (1 + np.log(np.asarray(counts, dtype=float))) * (math.log((1 + n) / (1 + len(ids))) + 1)
+        norms[ids] += weights * weights
+        # Terms found in a single section cannot link two sections; very common ones add noise.
+        if 2 <= len(ids) <= max_df:
+            index.append((ids, weights))
+    norms = np.sqrt(norms)
+    norms[norms == 0] = 1.0
+
+    doc_links = [[] for _ in range(n)]
+    for t, (ids, weights) in enumerate(index):
+        weights /= norms[ids]
+        for d, w in zip(ids.tolist(), weights.tolist()):
+            doc_links[d].append((t, w))
+
+    k = min(top_k, n - 1)
+    for d, (_, _, sec, _) in enumerate(docs):
+        sec["related"] = []
+        if k <= 0 or not doc_links[d]:
+            continue
+        ids = np.concatenate([index[t][0] for t, _ in doc_links[d]])
+        vals = np.concatenate([index[t][1] * w for t, w in doc_links[d]])
+        scores = np.bincount(ids, weights=vals, minlength=n)
+        scores[d] = 0.0
+        top = np.argpartition(-scores, k - 1)[:k]
+        for j in top[np.argsort(-scores[top])]:
+            if scores[j] > 0:
+                sec["related"].append({"url": docs[j][0], "section": docs[j][1], "score": round(float(scores[j]), 4)})
+    return reused
+
 # === Progress Tracking ===
 def init_sqlite(path=SQLITE_FILE):
     """Initialize SQLite database for progress."""
@@ -538,23 +706,82 @@ def init_sqlite(path=SQLITE_FILE):
             completed INTEGER DEFAULT 0,
             notes TEXT,
             last_reviewed TEXT,
+            content_hash TEXT,
             UNIQUE(chapter_url, section_index)
         )
         """)
+        if "content_hash" not in {row[1] for row in c.execute("PRAGMA table_info(progress)")}:
+            c.execute("ALTER TABLE progress ADD COLUMN content_hash TEXT")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS corpus_versions (
+            id INTEGER PRIMARY KEY,
+            source TEXT,
+            scraped_at TEXT,
+            sections_changed INTEGER DEFAULT 0
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS corpus_paragraphs (
+            hash TEXT PRIMARY KEY,
+            text TEXT
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS section_revisions (
+            id INTEGER PRIMARY KEY,
+            version_id INTEGER REFERENCES corpus_versions(id),
+            chapter_url TEXT,
+            section_index INTEGER,
+            content_hash TEXT,
+            heading TEXT,
+            base_id INTEGER,
+            depth INTEGER DEFAULT 0,
+            delta TEXT
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_revisions_section ON section_revisions (chapter_url, section_index, content_hash)")
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS section_terms (
+            hash TEXT PRIMARY KEY,
+            terms TEXT
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS study_events (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT,
+            event_type TEXT,
+            chapter_url TEXT,
+            section_index INTEGER,
+            ts TEXT,
+            seconds REAL DEFAULT 0
+        )
+        """)
+        for table, key in (("study_daily", "day TEXT"), ("study_weekly", "week TEXT"), ("study_chapter", "chapter_url TEXT")):
+            c.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id TEXT,
+                {key},
+                views INTEGER DEFAULT 0,
+                saves INTEGER DEFAULT 0,
+                seconds REAL DEFAULT 0,
+                PRIMARY KEY (user_id, {key.split()[0]})
+            )
+            """)
         conn.commit()
         return conn
     except Exception as e:
         st.error(f"Failed to initialize database: {e}")
         return None
 
-def update_progress(conn, chapter_url, section_index, completed=False, notes=None):
+def update_progress(conn, chapter_url, section_index, completed=False, notes=None, content_hash=None):
     """Update progress in SQLite."""
     try:
         c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO progress (chapter_url, section_index, completed, notes, last_reviewed) VALUES (?, ?, ?, ?, ?)",
-                  (chapter_url, section_index, int(completed), notes or "", datetime.now().isoformat()))
-        c.execute("UPDATE progress SET completed=?, notes=?, last_reviewed=? WHERE chapter_url=? AND section_index=?",
-                  (int(completed), notes or "", datetime.now().isoformat(), chapter_url, section_index))
+        c.execute("INSERT OR IGNORE INTO progress (chapter_url, section_index, completed, notes, last_reviewed, content_hash) VALUES (?, ?, ?, ?, ?, ?)",
+                  (chapter_url, section_index, int(completed), notes or "", datetime.now().isoformat(), content_hash))
+        c.execute("UPDATE progress SET completed=?, notes=?, last_reviewed=?, content_hash=COALESCE(?, content_hash) WHERE chapter_url=? AND section_index=?",
+                  (int(completed), notes or "", datetime.now().isoformat(), content_hash, chapter_url, section_index))
         conn.commit()
     except Exception as e:
         st.error(f"Failed to save progress: {e}")
@@ -563,14 +790,304 @@ def get_progress(conn, chapter_url, section_index):
     """Retrieve progress for a chapter and section."""
     try:
         c = conn.cursor()
-        c.execute("SELECT completed, notes FROM progress WHERE chapter_url=? AND section_index=?",
+        c.execute("SELECT completed, notes, content_hash FROM progress WHERE chapter_url=? AND section_index=?",
                   (chapter_url, section_index))
         row = c.fetchone()
-        return {"completed": bool(row[0]), "notes": row[1]} if row else None
+        return {"completed": bool(row[0]), "notes": row[1], "content_hash": row[2]} if row else None
     except Exception as e:
         st.error(f"Failed to retrieve progress: {e}")
         return None
 
+# === Corpus History ===
+def encode_delta(base, new):
+    """Encode `new` as copy/insert operations against `base` (both lists of paragraph hashes)."""
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif j2 > j1:
+            ops.append(["i"] + new[j1:j2])
+    return ops
+
+def apply_delta(base, ops):
+    """Rebuild a paragraph hash list from `base` and operations produced by encode_delta."""
+    out = []
+    for op in ops:
+        if op[0] == "c":
+            out.extend(base[op[1]:op[2]])
+        else:
+            out.extend(op[1:])
+    return out
+
+def load_revision(conn, revision_id):
+    """Reconstruct a section revision as (heading, paragraph_hashes) by replaying its delta chain."""
+    c = conn.cursor()
+    chain = []
+    while revision_id is not None:
+        c.execute("SELECT heading, base_id, delta FROM section_revisions WHERE id=?", (revision_id,))
+        row = c.fetchone()
+        if not row:
+            return None
+        chain.append(row)
+        revision_id = row[1]
+    hashes = []
+    for _, _, delta in reversed(chain):
+        hashes = apply_delta(hashes, json.loads(delta))
+    return chain[0][0], hashes
+
+def record_corpus_version(conn, db):
+    """Store a scrape run as a corpus version.
+
+    Only sections whose content hash differs from their latest revision get
+    a new revision, stored as a delta against it (or as a keyframe every
+    REVISION_KEYFRAME_INTERVAL revisions). Paragraph texts are stored once
+    by hash. Returns (version_id, sections_changed).
+    """
+    with conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO corpus_versions (source, scraped_at) VALUES (?, ?)",
+                  (db.get("source"), db.get("scraped_at")))
+        version_id = c.lastrowid
+        # SQLite returns the bare columns from the row holding MAX(id).
+        c.execute("SELECT chapter_url, section_index, MAX(id), content_hash, depth FROM section_revisions GROUP BY chapter_url, section_index")
+        heads = {(url, idx): (rid, h, depth) for url, idx, rid, h, depth in c.fetchall()}
+        c.executemany("INSERT OR IGNORE INTO corpus_paragraphs (hash, text) VALUES (?, ?)",
+                      db.get("paragraphs", {}).items())
+        changed = 0
+        for ch in db.get("chapters", []):
+            url = ch.get("url")
+            for idx, sec in enumerate(ch.get("sections", [])):
+                h = section_content_hash(sec)
+                head = heads.get((url, idx))
+                if head and head[1] == h:
+                    continue
+                hashes = sec.get("paragraphs", [])
+                base = load_revision(conn, head[0]) if head and head[2] + 1 < REVISION_KEYFRAME_INTERVAL else None
+                if base:
+                    base_id, depth, delta = head[0], head[2] + 1, encode_delta(base[1], hashes)
+                else:
+                    base_id, depth, delta = None, 0, encode_delta([], hashes)
+                c.execute("INSERT INTO section_revisions (version_id, chapter_url, section_index, content_hash, heading, base_id, depth, delta) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (version_id, url, idx, h, sec.get("heading"), base_id, depth, json.dumps(delta, separators=(",", ":"))))
+                changed += 1
+        c.execute("UPDATE corpus_versions SET sections_changed=? WHERE id=?", (changed, version_id))
+    return version_id, changed
+
+def get_revision_paragraphs(conn, chapter_url, section_index, content_hash):
+    """Return the paragraph texts of a stored section revision, or None if it is unknown."""
+    try:
+        c = conn.cursor()
+        c.execute("SELECT MAX(id) FROM section_revisions WHERE chapter_url=? AND section_index=? AND content_hash=?",
+                  (chapter_url, section_index, content_hash))
+        row = c.fetchone()
+        revision = load_revision(conn, row[0]) if row and row[0] is not None else None
+        if not revision:
+            return None
+        hashes = revision[1]
+        texts = {}
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            c.execute(f"SELECT hash, text FROM corpus_paragraphs WHERE hash IN ({', '.join('?' * len(chunk))})", chunk)
+            texts.update(c.fetchall())
+        return [texts.get(h, "") for h in hashes]
+    except Exception as e:
+        st.error(f"Failed to load section history: {e}")
+        return None
+
+# === Study Analytics ===
+def record_study_event(conn, user_id, event_type, chapter_url, section_index, seconds=0.0):
+    """Append a study event ('view', 'save' or 'time') and fold it into the aggregates.
+
+    Daily, weekly and per-chapter totals are updated in the same
+    transaction, so dashboards never need to rescan study_events.
+    """
+    try:
+        now = datetime.now()
+        views, saves = int(event_type == "view"), int(event_type == "save")
+        with conn:
+            conn.execute("INSERT INTO study_events (user_id, event_type, chapter_url, section_index, ts, seconds) VALUES (?, ?, ?, ?, ?, ?)",
+                         (user_id, event_type, chapter_url, section_index, now.isoformat(), seconds))
+            for table, key, value in (("study_daily", "day", now.date().isoformat()),
+                                      ("study_weekly", "week", now.strftime("%G-W%V")),
+                                      ("study_chapter", "chapter_url", chapter_url)):
+                conn.execute(f"""
+                    INSERT INTO {table} (user_id, {key}, views, saves, seconds) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, {key}) DO UPDATE SET
+                        views=views + excluded.views,
+                        saves=saves + excluded.saves,
+                        seconds=seconds + excluded.seconds
+                """, (user_id, value, views, saves, seconds))
+    except Exception as e:
+        st.error(f"Failed to record study event: {e}")
+
+def compute_streaks(days, today=None):
+    """Return (current, longest) streaks of consecutive study days from ISO date strings."""
+    today = today or date.today()
+    ordered = sorted({date.fromisoformat(d) for d in days})
+    longest = run = 0
+    prev = None
+    for d in ordered:
+        run = run + 1 if prev and d - prev == timedelta(days=1) else 1
+        longest = max(longest, run)
+        prev = d
+    current = run if prev and today - prev <= timedelta(days=1) else 0
+    return current, longest
+
+def get_study_summary(conn, user_id, weeks=12):
+    """Read dashboard figures for a user from the aggregate tables only."""
+    try:
+        c = conn.cursor()
+        c.execute("SELECT day FROM study_daily WHERE user_id=? AND (views > 0 OR seconds > 0)", (user_id,))
+        current, longest = compute_streaks([row[0] for row in c.fetchall()])
+        since = (date.today() - timedelta(days=6)).isoformat()
+        c.execute("SELECT COALESCE(SUM(views), 0), COALESCE(SUM(seconds), 0) FROM study_daily WHERE user_id=? AND day >= ?",
+                  (user_id, since))
+        week_views, week_seconds = c.fetchone()
+        c.execute("SELECT week, views, seconds FROM study_weekly WHERE user_id=? ORDER BY week DESC LIMIT ?", (user_id, weeks))
+        weekly = list(reversed(c.fetchall()))
+        c.execute("SELECT chapter_url, views, saves, seconds FROM study_chapter WHERE user_id=? ORDER BY seconds DESC", (user_id,))
+        per_chapter = c.fetchall()
+        return {"current_streak": current, "longest_streak": longest,
+                "sections_per_day": week_views / 7, "minutes_per_section": week_seconds / 60 / week_views if week_views else 0,
+                "weekly": weekly, "per_chapter": per_chapter}
+    except Exception as e:
+        st.error(f"Failed to load study analytics: {e}")
+        return None
+
+def render_study_dashboard(conn, user_id, chapters):
+    """Render streaks, reading pace and time per chapter."""
+    summary = get_study_summary(conn, user_id)
+    if not summary:
+        return
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("🔥 Current Streak", f"{summary['current_streak']} days")
+    m2.metric("🏆 Longest Streak", f"{summary['longest_streak']} days")
+    m3.metric("📄 Sections / Day (7d)", f"{summary['sections_per_day']:.1f}")
+    m4.metric("⏱️ Minutes / Section (7d)", f"{summary['minutes_per_section']:.1f}")
+    if summary["weekly"]:
+        st.markdown("**Weekly study time (minutes)**")
+        st.bar_chart({"Minutes": {week: seconds / 60 for week, _, seconds in summary["weekly"]}})
+    if summary["per_chapter"]:
+        titles = {c.get("url"): c.get("title", "(No Title)") for c in chapters}
+        st.markdown("**Time per chapter (minutes)**")
+        st.bar_chart({"Minutes": {titles.get(url, url): seconds / 60 for url, _, _, seconds in summary["per_chapter"]}})
+
+# === Bulk Export / Import ===
+PROGRESS_COLUMNS = ("chapter_url", "section_index", "completed", "notes", "last_reviewed", "content_hash")
+EXPORT_BATCH_SIZE = 1000
+
+def infer_format(path, default="jsonl"):
+    """Infer the export format ('jsonl' or 'csv') from a file name."""
+    ext = os.path.splitext(path or "")[1].lower()
+    return "csv" if ext == ".csv" else "jsonl" if ext in (".jsonl", ".json", ".ndjson") else default
+
+def iter_progress_rows(conn, batch_size=EXPORT_BATCH_SIZE):
+    """Stream progress rows as dicts, fetching in batches instead of fetchall."""
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(PROGRESS_COLUMNS)} FROM progress ORDER BY chapter_url, section_index")
+    while True:
+        rows = c.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(PROGRESS_COLUMNS, row))
+
+def export_progress(conn, fp, fmt="jsonl"):
+    """Write the progress table to an open text file as JSONL or CSV. Returns the row count."""
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(fp, fieldnames=PROGRESS_COLUMNS)
+        writer.writeheader()
+        for row in iter_progress_rows(conn):
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in iter_progress_rows(conn):
+            fp.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+def _read_progress_records(fp, fmt):
+    """Yield raw records from a JSONL or CSV stream; JSONL lines are yielded unparsed."""
+    if fmt == "csv":
+        yield from csv.DictReader(fp)
+    else:
+        for line in fp:
+            if line.strip():
+                yield line
+
+def _progress_params(records, skipped):
+    """Normalize records into parameter tuples for executemany, counting malformed rows."""
+    for rec in records:
+        try:
+            if isinstance(rec, str):
+                rec = json.loads(rec)
+            completed = rec.get("completed") or 0
+            if isinstance(completed, str):
+                completed = completed.strip().lower() in ("1", "true", "yes")
+            yield (str(rec["chapter_url"]), int(rec["section_index"]), int(bool(completed)),
+                   rec.get("notes") or "", rec.get("last_reviewed") or "", rec.get("content_hash") or None)
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError, AttributeError):
+            skipped[0] += 1
+
+def import_progress(conn, fp, fmt="jsonl"):
+    """Import progress rows in a single transaction.
+
+    Conflicting rows are resolved by last_reviewed: an incoming row only
+    replaces an existing one when it was reviewed more recently.
+    Returns (applied, skipped).
+    """
+    skipped = [0]
+    before = conn.total_changes
+    with conn:
+        conn.executemany("""
+            INSERT INTO progress (chapter_url, section_index, completed, notes, last_reviewed, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chapter_url, section_index) DO UPDATE SET
+                completed=excluded.completed,
+                notes=excluded.notes,
+                last_reviewed=excluded.last_reviewed,
+                content_hash=excluded.content_hash
+            WHERE excluded.last_reviewed > COALESCE(progress.last_reviewed, '')
+        """, _progress_params(_read_progress_records(fp, fmt), skipped))
+    return conn.total_changes - before, skipped[0]
+
+def run_cli(argv):
+    """Command-line entry point for bulk progress export/import."""
+    parser = argparse.ArgumentParser(prog="pmg.py", description="Bulk export/import of study progress and notes.")
+    parser.add_argument("--db", default=SQLITE_FILE, help="Path to the progress SQLite database.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("export", "import"):
+        cmd = sub.add_parser(name, help=f"{name.capitalize()} progress as JSONL or CSV ('-' for stdio).")
+        cmd.add_argument("path")
+        cmd.add_argument("--format", choices=("jsonl", "csv"), default=None)
+    args = parser.parse_args(argv)
+    fmt = args.format or infer_format(args.path)
+    conn = init_sqlite(args.db)
+    if conn is None:
+        return 1
+    try:
+        if args.command == "export":
+            if args.path == "-":
+                count = export_progress(conn, sys.stdout, fmt)
+            else:
+                with open(args.path, "w", encoding="utf-8", newline="") as f:
+                    count = export_progress(conn, f, fmt)
+            print(f"Exported {count} rows.", file=sys.stderr)
+        else:
+            if args.path == "-":
+                applied, skipped = import_progress(conn, sys.stdin, fmt)
+            else:
+                with open(args.path, "r", encoding="utf-8", newline="") as f:
+                    applied, skipped = import_progress(conn, f, fmt)
+            print(f"Imported {applied} rows ({skipped} skipped).", file=sys.stderr)
+        return 0
+    except (OSError, sqlite3.Error) as e:
+        print(f"Failed to {args.command} progress: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
 # === Text Formatting ===
 BOOKS = ["John", "Matthew", "Mark", "Luke", "Romans", "Alma", "Mosiah", "Helaman", "3 Nephi", "2 Nephi", "Ether", "Moroni", "Psalms", "Proverbs", "Isaiah", "Genesis", "Exodus", "Doctrine and Covenants", "1 Corinthians", "2 Corinthians", "Ephesians", "Philippians", "Colossians", "1 Thessalonians", "2 Thessalonians", "1 Timothy", "2 Timothy", "Titus", "Philemon", "Hebrews", "James", "1 Peter", "2 Peter", "1 John", "2 John", "3 John", "Jude", "Revelation"]
 BOOK_RE = r'(' + r'|'.join([re.escape(b) for b in BOOKS]) + r')\s+\d+[:]\d+(-\d+)?'
@@ -589,8 +1106,20 @@ def format_text(text):
         st.error(f"Failed to format text: {e}")
         return [text] if text else []
 
+# === Command Line ===
+# `python pmg.py export notes.jsonl` / `python pmg.py import notes.csv`; under `streamlit run` the UI below is used instead.
+if __name__ == "__main__" and not st.runtime.exists() and os.path.basename(sys.argv[0]) == os.path.basename(__file__):
+    sys.exit(run_cli(sys.argv[1:]))
+
 # === Streamlit UI ===
 st.set_page_config(page_title="📖 Preach My Gospel Study", layout="wide", initial_sidebar_state="expanded")
+st.markdown(APP_CSS, unsafe_allow_html=True)
+
+# Initialize NLTK resources
+try:
+    ensure_nltk_resources()
+except Exception as e:
+    st.error(f"Failed to initialize NLTK resources: {e}. Related sections will use a simpler tokenizer.")
 
 # Display Streamlit version for debugging
 st.markdown(f"<div style='font-size: 0.875rem; color: #718096; text-align: center;'>Streamlit Version: {st.__version__}</div>", unsafe_allow_html=True)
@@ -608,6 +1137,8 @@ st.markdown("""
 # Sidebar: Controls
 with st.sidebar:
     st.markdown("<h2 style='color: #FFFFFF; margin-bottom: 1.5rem;'>📚 Study Controls</h2>", unsafe_allow_html=True)
+    conn = init_sqlite()
+    user_id = st.text_input("👤 Study profile", value="default", key="user_id").strip() or "default"
     
     if st.button("🔄 Scrape Official Manual"):
         with st.spinner("📥 Fetching *Preach My Gospel* content..."):
@@ -619,9 +1150,16 @@ with st.sidebar:
                     st.stop()
                 st.info(f"Found {len(links)} chapters.")
                 chapters = scrape_chapters_concurrent(links)
-                db = {"source": BASE_MANUAL_URL, "scraped_at": time.asctime(), "chapters": chapters}
+                chapters, paragraphs, stripped = dedupe_chapters(chapters)
+                reused = build_related_index(chapters, paragraphs, conn)
+                db = {"source": BASE_MANUAL_URL, "scraped_at": time.asctime(), "chapters": chapters,
+                      "paragraphs": paragraphs}
                 save_json(DB_JSON, db)
-                st.success(f"✅ Saved {len(chapters)} chapters to database.")
+                st.success(f"✅ Saved {len(chapters)} chapters to database ({len(paragraphs)} unique paragraphs, {stripped} boilerplate removed).")
+                if conn:
+                    version_id, changed = record_corpus_version(conn, db)
+                    st.info(f"Stored as version {version_id}: {changed} sections new or changed.")
+                st.info(f"Related sections indexed ({reused} sections reused from the previous scrape).")
                 st.markdown("<div class='motivation'>🎉 You're ready to dive in!</div>", unsafe_allow_html=True)
             except Exception as e:
                 st.error(f"❌ Failed to scrape: {e}. Check your connection or try again later.")
@@ -638,7 +1176,6 @@ with st.sidebar:
     
     # Progress Section
     st.markdown("<h3 style='color: #FFFFFF; margin-bottom: 1.25rem;'>📊 Your Progress</h3>", unsafe_allow_html=True)
-    conn = init_sqlite()
     if conn:
         c = conn.cursor()
         c.execute("SELECT COUNT(*) FROM progress WHERE completed=1")
@@ -658,6 +1195,29 @@ with st.sidebar:
     else:
         st.error("❌ Database not initialized. Progress tracking unavailable.")
 
+    # Backup & Restore Section
+    if conn:
+        st.markdown("<hr style='border-color: #B7C0CC; margin: 1.5rem 0;'>", unsafe_allow_html=True)
+        st.markdown("<h3 style='color: #FFFFFF; margin-bottom: 1.25rem;'>💾 Backup & Restore</h3>", unsafe_allow_html=True)
+        backup_fmt = st.radio("Format", options=["jsonl", "csv"], horizontal=True, key="backup_fmt")
+        if st.button("📤 Prepare Export"):
+            buf = io.StringIO()
+            count = export_progress(conn, buf, backup_fmt)
+            st.session_state["backup_data"] = (buf.getvalue(), backup_fmt, count)
+        if st.session_state.get("backup_data"):
+            data, data_fmt, count = st.session_state["backup_data"]
+            st.download_button(f"⬇️ Download {count} rows", data=data.encode("utf-8"),
+                               file_name=f"pmg_progress.{data_fmt}",
+                               mime="text/csv" if data_fmt == "csv" else "application/jsonl")
+        upload = st.file_uploader("Import progress", type=["jsonl", "json", "ndjson", "csv"])
+        if upload is not None and st.button("📥 Import"):
+            try:
+                stream = io.TextIOWrapper(upload, encoding="utf-8", newline="")
+                applied, skipped = import_progress(conn, stream, infer_format(upload.name))
+                st.success(f"✅ Imported {applied} rows ({skipped} skipped).")
+            except Exception as e:
+                st.error(f"❌ Failed to import progress: {e}")
+
 # Main Content
 db = load_json(DB_JSON)
 if not db:
@@ -674,6 +1234,11 @@ if not chapters:
     st.warning("⚠️ No chapters available. Try scraping again.")
     st.stop()
 
+def jump_to_section(chapter_idx, section_idx):
+    """Select a chapter and section from a related-section link."""
+    st.session_state["chapter_select"] = chapter_idx
+    st.session_state[f"section_select_{chapter_idx}"] = section_idx
+
 # Enhanced Layout
 col1, col2 = st.columns([1, 3], gap="large")
 
@@ -686,7 +1251,8 @@ with col1:
         "Choose a Chapter", 
         options=list(range(len(titles))), 
         format_func=lambda i: f"{i+1}. {titles[i]}", 
-        label_visibility="collapsed"
+        label_visibility="collapsed",
+        key="chapter_select"
     )
     
     ch = chapters[sel_idx]
@@ -706,16 +1272,36 @@ with col1:
         "Choose a Section", 
         options=list(range(len(sec_titles))), 
         format_func=lambda i: f"{i+1}. {sec_titles[i][:50]}{'...' if len(sec_titles[i]) > 50 else ''}", 
-        label_visibility="collapsed"
+        label_visibility="collapsed",
+        key=f"section_select_{sel_idx}"
     )
     
+    # Study Session Tracking
+    section_key = (ch.get("url"), sec_idx)
+    # Every rerun (navigation, typing, saving) credits the time since the previous one
+    # to the section that was on screen, so single-section visits are counted too.
+    viewing = st.session_state.get("viewing")
+    if conn:
+        now = time.time()
+        if viewing:
+            elapsed = min(now - viewing[1], MAX_SECTION_SECONDS)
+            if elapsed > 0:
+                record_study_event(conn, user_id, "time", *viewing[0], seconds=elapsed)
+        if viewing is None or viewing[0] != section_key:
+            record_study_event(conn, user_id, "view", *section_key)
+        st.session_state["viewing"] = (section_key, now)
+    
     # Progress Display
     prog = get_progress(conn, ch.get("url"), sec_idx) if conn else None
+    current_hash = section_content_hash(ch.get("sections", [])[sec_idx])
+    section_changed = bool(prog and prog.get("content_hash") and prog["content_hash"] != current_hash)
     if prog:
         if prog['completed']:
             st.markdown("<div class='status-completed'>✅ Completed</div>", unsafe_allow_html=True)
         else:
             st.markdown("<div class='status-in-progress'>🔄 In Progress</div>", unsafe_allow_html=True)
+        if section_changed:
+            st.warning("⚠️ This section changed since you studied it.")
         
         if prog.get("notes"):
             st.markdown("<h5 style='margin-top: 1rem; margin-bottom: 0.5rem; color: #FFFFFF; font-weight: 600;'>📝 Your Notes:</h5>", unsafe_allow_html=True)
@@ -729,7 +1315,7 @@ with col2:
     # Section Content
     section = ch.get("sections", [])[sec_idx]
     heading = section.get("heading", "No Heading")
-    text = section.get("text", "")
+    text = section_text(db, section)
     paragraphs = format_text(text)
     
     st.markdown(f"""
@@ -737,12 +1323,40 @@ with col2:
         <h3 style="color: #1F2A44; margin-bottom: 1.5rem;">{heading}</h3>
     """, unsafe_allow_html=True)
     
+    if not paragraphs:
+        st.info("ℹ️ This section only contained navigation or footer text.")
     for p in paragraphs:
         # Wrap each paragraph in a div to ensure spacing is respected
         st.markdown(f"<div style='margin-bottom: 1.5rem;'><p>{p}</p></div>", unsafe_allow_html=True)
     
     st.markdown("</div>", unsafe_allow_html=True)
     
+    if section_changed:
+        old_paragraphs = get_revision_paragraphs(conn, ch.get("url"), sec_idx, prog["content_hash"])
+        with st.expander("🕘 What changed since you studied this section"):
+            if old_paragraphs is None:
+                st.write("The version you studied is not in the local history.")
+            else:
+                current_paragraphs = [p for p in text.split("\n\n") if p.strip()]
+                for line in difflib.ndiff(old_paragraphs, current_paragraphs):
+                    if line.startswith("- "):
+                        st.markdown(f"➖ ~~{line[2:]}~~")
+                    elif line.startswith("+ "):
+                        st.markdown(f"➕ {line[2:]}")
+    
+    # Related Sections
+    related = section.get("related", [])
+    if related:
+        chapter_positions = {c.get("url"): i for i, c in enumerate(chapters)}
+        st.markdown("<h4 style='color: #1F2A44; margin-bottom: 0.75rem;'>🔗 Related Sections</h4>", unsafe_allow_html=True)
+        for n, rel in enumerate(related):
+            ci = chapter_positions.get(rel.get("url"))
+            if ci is None or rel.get("section", 0) >= len(chapters[ci].get("sections", [])):
+                continue
+            target = chapters[ci]["sections"][rel["section"]]
+            st.button(f"{chapters[ci].get('title', '(No Title)')} › {target.get('heading', '(No Heading)')}",
+                      key=f"related_{sel_idx}_{sec_idx}_{n}", on_click=jump_to_section, args=(ci, rel["section"]))
+    
     # Progress and Notes Section
     st.markdown("<div class='notes-section'>", unsafe_allow_html=True)
     st.markdown("<h3 style='color: #1F2A44; margin-bottom: 1.25rem;'>📝 Progress & Notes</h3>", unsafe_allow_html=True)
@@ -762,11 +1376,12 @@ with col2:
     if st.button("💾 Save Progress", key=f"save_{sel_idx}_{sec_idx}"):
         try:
             if conn:
-                update_progress(conn, ch.get("url"), sec_idx, completed=complete, notes=note)
+                update_progress(conn, ch.get("url"), sec_idx, completed=complete, notes=note, content_hash=current_hash)
+                record_study_event(conn, user_id, "save", ch.get("url"), sec_idx)
                 st.success("✅ Progress saved successfully!")
                 st.markdown("<div class='motivation'>🎉 Great job studying this section!</div>", unsafe_allow_html=True)
                 time.sleep(1)
-                st.experimental_rerun()
+                st.rerun()
             else:
                 st.error("❌ Database not available. Progress not saved.")
         except Exception as e:
@@ -775,6 +1390,12 @@ with col2:
     st.markdown("</div>", unsafe_allow_html=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
+with st.expander("📈 Study Insights"):
+    if conn:
+        render_study_dashboard(conn, user_id, chapters)
+    else:
+        st.write("Study analytics are unavailable without the progress database.")
+
 # Footer
 st.markdown("""
 <div class="stCaption" style="margin-top: 3rem;">
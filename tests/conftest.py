@@ -0,0 +1,42 @@
+import json, os, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope="session")
+def pmg(tmp_path_factory):
+    """Import pmg.py from a scratch directory.
+
+    Importing runs the Streamlit UI in bare mode, which reads and writes
+    data/ relative to the working directory, so give it a tiny corpus there.
+    """
+    workdir = tmp_path_factory.mktemp("app")
+    os.makedirs(workdir / "data")
+    corpus = {"chapters": [{"url": "u", "title": "T", "sections": [{"heading": "H", "paragraphs": []}]}], "paragraphs": {}}
+    with open(workdir / "data" / "preach_my_gospel_db.json", "w", encoding="utf-8") as f:
+        json.dump(corpus, f)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    try:
+        import pmg as module
+    finally:
+        sys.path.remove(ROOT)
+        os.chdir(cwd)
+    return module
+
+@pytest.fixture(scope="session")
+def loadtest():
+    sys.path.insert(0, ROOT)
+    try:
+        import loadtest as module
+    finally:
+        sys.path.remove(ROOT)
+    return module
+
+@pytest.fixture
+def conn(pmg, tmp_path):
+    conn = pmg.init_sqlite(str(tmp_path / "progress.sqlite3"))
+    yield conn
+    conn.close()
@@ -0,0 +1,267 @@
+import io, json, os, sqlite3
+from collections import Counter
+from datetime import date
+
+import numpy as np
+
+import pytest
+
+def make_db(pmg, sections_by_chapter):
+    """Build a corpus the way the scraper does, from {chapter_url: [paragraph lists]}."""
+    chapters = [{"url": url, "title": url, "sections": [{"heading": f"{url}-{i}", "text": "\n\n".join(paras)}
+                                                       for i, paras in enumerate(sections)]}
+                for url, sections in sections_by_chapter.items()]
+    chapters, paragraphs, _ = pmg.dedupe_chapters(chapters)
+    return {"source": "test", "scraped_at": "now", "chapters": chapters, "paragraphs": paragraphs}
+
+# === Corpus deduplication ===
+def test_boilerplate_threshold(pmg):
+    # 8 chapters: a paragraph must appear in at least 4 of them to be boilerplate.
+    chapters = {f"u{i}": [[f"unique {i}", *(["in four"] if i < 4 else []), *(["in three"] if i < 3 else [])]]
+                for i in range(8)}
+    db = make_db(pmg, chapters)
+    texts = [db["paragraphs"][h] for h in db["chapters"][0]["sections"][0]["paragraphs"]]
+    assert texts == ["unique 0", "in three"]
+
+def test_boilerplate_only_section_is_kept_as_placeholder(pmg):
+    db = make_db(pmg, {f"u{i}": [["Skip to main content"], [f"body {i}"]] for i in range(4)})
+    sections = db["chapters"][0]["sections"]
+    assert [s["heading"] for s in sections] == ["u0-0", "u0-1"]
+    assert sections[0]["paragraphs"] == []
+    assert pmg.section_text(db, sections[1]) == "body 0"
+
+def test_repeated_paragraphs_within_a_section_are_kept(pmg):
+    db = make_db(pmg, {"u": [["same", "other", "same"]]})
+    assert pmg.section_text(db, db["chapters"][0]["sections"][0]) == "same\n\nother\n\nsame"
+
+def test_legacy_inline_text_sections(pmg):
+    legacy = {"heading": "H", "text": "first\n\nsecond"}
+    db = make_db(pmg, {"u": [["first", "second"]]})
+    hashed = db["chapters"][0]["sections"][0]
+    hashed["heading"] = "H"
+    hashed.pop("hash")
+    assert pmg.section_text({}, legacy) == "first\n\nsecond"
+    assert pmg.section_content_hash(legacy) == pmg.section_content_hash(hashed)
+
+def test_scrape_chapter_skips_container_divs(pmg, monkeypatch):
+    html = """<html><body><article>
+        <h2>Heading</h2>
+        <div class="wrapper"><p>First paragraph text.</p><div>Nested leaf div text.</div></div>
+        <p>Second paragraph text.</p>
+    </article></body></html>"""
+    monkeypatch.setattr(pmg, "fetch_url", lambda url: html)
+    chapter = pmg.scrape_chapter("https://www.churchofjesuschrist.org/study/x")
+    assert chapter["sections"] == [{"heading": "Heading", "text": "First paragraph text.\n\nNested leaf div text.\n\nSecond paragraph text."}]
+
+# === Related sections ===
+RELATED_CORPUS = {
+    "u1": [["faith hope charity faith"], ["baptism water covenant"], ["prayer morning evening"]],
+    "u2": [["faith charity service"], ["covenant baptism ordinance temple"], ["prayer fasting"]],
+    "u3": [["hope faith endure"], ["temple ordinance sealing"], ["scripture study prayer morning"]],
+}
+
+def dense_related(pmg, db, top_k):
+    """Reference implementation: dense sublinear TF-IDF cosine over the same tokens."""
+    docs = [(ch["url"], i, sec) for ch in db["chapters"] for i, sec in enumerate(ch["sections"])]
+    counts = [Counter(pmg.tokenize(pmg.section_text(db, sec))) for _, _, sec in docs]
+    vocab = sorted(set().union(*counts))
+    n = len(docs)
+    tf = np.array([[c.get(t, 0) for t in vocab] for c in counts], dtype=float)
+    df = (tf > 0).sum(axis=0)
+    weights = np.where(tf > 0, 1 + np.log(np.where(tf > 0, tf, 1)), 0) * (np.log((1 + n) / (1 + df)) + 1)
+    weights /= np.linalg.norm(weights, axis=1, keepdims=True)
+    linking = (df >= 2) & (df <= max(2, int(n * pmg.TFIDF_MAX_DF)))
+    sims = weights[:, linking] @ weights[:, linking].T
+    np.fill_diagonal(sims, 0)
+    expected = []
+    for d in range(n):
+        order = [j for j in np.argsort(-sims[d], kind="stable")[:top_k] if sims[d, j] > 0]
+        expected.append([(docs[j][0], docs[j][1], round(float(sims[d, j]), 4)) for j in order])
+    return expected
+
+def related_of(db):
+    return [[(r["url"], r["section"], r["score"]) for r in sec["related"]]
+            for ch in db["chapters"] for sec in ch["sections"]]
+
+def test_related_sections_match_dense_cosine(pmg):
+    db = make_db(pmg, RELATED_CORPUS)
+    pmg.build_related_index(db["chapters"], db["paragraphs"], top_k=3)
+    expected = dense_related(pmg, db, top_k=3)
+    actual = related_of(db)
+    assert any(actual)
+    for got, want in zip(actual, expected):
+        assert [r[2] for r in got] == pytest.approx([r[2] for r in want], abs=1e-4)
+        assert [r[2] for r in got] == sorted((r[2] for r in got), reverse=True)
+        # Ties may come back in either order; the set of neighbours must agree.
+        assert sorted(got) == sorted(want)
+
+def test_related_sections_never_include_self(pmg):
+    db = make_db(pmg, RELATED_CORPUS)
+    pmg.build_related_index(db["chapters"], db["paragraphs"], top_k=10)
+    for ch in db["chapters"]:
+        for i, sec in enumerate(ch["sections"]):
+            assert (ch["url"], i) not in {(r["url"], r["section"]) for r in sec["related"]}
+
+def test_related_index_reuses_cached_terms(pmg, conn, monkeypatch):
+    # Include a boilerplate-only placeholder: its empty term counts must be cached too.
+    corpus = {**RELATED_CORPUS, "u4": [["menu"]], "u5": [["menu"]], "u6": [["menu"], ["fasting prayer"]]}
+    db = make_db(pmg, corpus)
+    sections = sum(len(ch["sections"]) for ch in db["chapters"])
+    assert pmg.build_related_index(db["chapters"], db["paragraphs"], conn) == 0
+    first = related_of(db)
+    tokenized = []
+    monkeypatch.setattr(pmg, "tokenize", lambda text: tokenized.append(text) or [])
+    assert pmg.build_related_index(db["chapters"], db["paragraphs"], conn) == sections
+    assert tokenized == []
+    assert related_of(db) == first
+    assert "terms" not in db["chapters"][0]["sections"][0]
+
+# === Corpus history ===
+@pytest.mark.parametrize("base, new", [
+    ([], []),
+    ([], ["a", "b"]),
+    (["a", "b"], []),
+    (["a", "b", "c"], ["a", "b", "c"]),
+    (["a", "b", "c"], ["a", "x", "c"]),
+    (["a", "b", "c"], ["c", "b", "a"]),
+    (["a", "b", "c"], ["x", "a", "b", "c", "y"]),
+    (["a", "a", "b"], ["a", "b", "b", "a"]),
+])
+def test_delta_round_trip(pmg, base, new):
+    assert pmg.apply_delta(base, pmg.encode_delta(base, new)) == new
+
+def test_unchanged_sections_add_no_revisions(pmg, conn):
+    db = make_db(pmg, {"u1": [["one", "two"], ["three"]], "u2": [["four"]]})
+    assert pmg.record_corpus_version(conn, db)[1] == 3
+    assert pmg.record_corpus_version(conn, db)[1] == 0
+    assert conn.execute("SELECT COUNT(*) FROM section_revisions").fetchone()[0] == 3
+
+def test_revision_chain_longer_than_keyframe_interval(pmg, conn):
+    versions = []
+    paras = ["intro", "body"]
+    for v in range(2 * pmg.REVISION_KEYFRAME_INTERVAL + 3):
+        paras = paras[:1] + [f"edit {v}"] + paras[1:]
+        if v % 4 == 3:
+            paras = paras[:-1]
+        db = make_db(pmg, {"u": [list(paras)]})
+        assert pmg.record_corpus_version(conn, db)[1] == 1
+        versions.append((db["chapters"][0]["sections"][0]["hash"], list(paras)))
+
+    for content_hash, expected in versions:
+        assert pmg.get_revision_paragraphs(conn, "u", 0, content_hash) == expected
+    depths = [row[0] for row in conn.execute("SELECT depth FROM section_revisions ORDER BY id")]
+    assert max(depths) == pmg.REVISION_KEYFRAME_INTERVAL - 1
+    assert depths.count(0) == 3
+    assert conn.execute("SELECT COUNT(*) FROM section_revisions WHERE depth = 0 AND base_id IS NOT NULL").fetchone()[0] == 0
+
+def test_unknown_revision_returns_none(pmg, conn):
+    assert pmg.get_revision_paragraphs(conn, "u", 0, "missing") is None
+
+# === Bulk export / import ===
+def import_jsonl(pmg, conn, rows):
+    return pmg.import_progress(conn, io.StringIO("".join(json.dumps(r) + "\n" for r in rows)), "jsonl")
+
+def notes_for(conn, url, idx):
+    return conn.execute("SELECT notes FROM progress WHERE chapter_url=? AND section_index=?", (url, idx)).fetchone()[0]
+
+def test_import_keeps_most_recently_reviewed_row(pmg, conn):
+    import_jsonl(pmg, conn, [
+        {"chapter_url": "u", "section_index": 0, "notes": "local old", "last_reviewed": "2026-01-01T00:00:00"},
+        {"chapter_url": "u", "section_index": 1, "notes": "local new", "last_reviewed": "2026-03-01T00:00:00"},
+    ])
+    applied, skipped = import_jsonl(pmg, conn, [
+        {"chapter_url": "u", "section_index": 0, "notes": "incoming new", "last_reviewed": "2026-02-01T00:00:00"},
+        {"chapter_url": "u", "section_index": 1, "notes": "incoming old", "last_reviewed": "2026-02-01T00:00:00"},
+        {"chapter_url": "u", "section_index": 2, "notes": "incoming only", "last_reviewed": "2026-02-01T00:00:00"},
+    ])
+    assert (applied, skipped) == (2, 0)
+    assert notes_for(conn, "u", 0) == "incoming new"
+    assert notes_for(conn, "u", 1) == "local new"
+    assert notes_for(conn, "u", 2) == "incoming only"
+
+def test_import_tie_keeps_existing_row(pmg, conn):
+    row = {"chapter_url": "u", "section_index": 0, "notes": "first", "last_reviewed": "2026-01-01T00:00:00"}
+    import_jsonl(pmg, conn, [row])
+    assert import_jsonl(pmg, conn, [dict(row, notes="second")]) == (0, 0)
+    assert notes_for(conn, "u", 0) == "first"
+
+def test_import_skips_malformed_rows(pmg, conn):
+    data = "\n".join([
+        json.dumps({"chapter_url": "u", "section_index": 0, "last_reviewed": "2026"}),
+        "{not json",
+        "[1, 2]",
+        json.dumps({"chapter_url": "u"}),
+        json.dumps({"chapter_url": "u", "section_index": "x"}),
+    ]) + "\n"
+    assert pmg.import_progress(conn, io.StringIO(data), "jsonl") == (1, 4)
+
+@pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+def test_export_import_round_trip(pmg, conn, tmp_path, fmt):
+    pmg.update_progress(conn, "u", 0, completed=True, notes="note, with \"quotes\"\nand a newline", content_hash="abc")
+    pmg.update_progress(conn, "v", 3, completed=False, notes="")
+    buf = io.StringIO()
+    assert pmg.export_progress(conn, buf, fmt) == 2
+
+    other = pmg.init_sqlite(str(tmp_path / "other.sqlite3"))
+    assert pmg.import_progress(other, io.StringIO(buf.getvalue()), fmt) == (2, 0)
+    assert list(pmg.iter_progress_rows(other)) == list(pmg.iter_progress_rows(conn))
+    other.close()
+
+# === Study analytics ===
+TODAY = date(2026, 10, 19)
+
+@pytest.mark.parametrize("days, expected", [
+    ([], (0, 0)),
+    (["2026-10-19"], (1, 1)),
+    (["2026-10-18"], (1, 1)),
+    (["2026-10-17"], (0, 1)),
+    (["2026-10-19", "2026-10-19", "2026-10-18"], (2, 2)),
+    (["2026-10-19", "2026-10-17", "2026-10-16"], (1, 2)),
+    (["2026-10-01", "2026-10-02", "2026-10-03", "2026-10-18", "2026-10-19"], (2, 3)),
+    (["2025-12-31", "2026-01-01", "2026-01-02"], (0, 3)),
+])
+def test_compute_streaks(pmg, days, expected):
+    assert pmg.compute_streaks(days, today=TODAY) == expected
+
+def test_study_events_update_aggregates_incrementally(pmg, conn):
+    pmg.record_study_event(conn, "me", "view", "u", 0)
+    pmg.record_study_event(conn, "me", "time", "u", 0, seconds=90)
+    pmg.record_study_event(conn, "me", "save", "u", 0)
+    pmg.record_study_event(conn, "other", "view", "u", 0)
+    assert conn.execute("SELECT views, saves, seconds FROM study_chapter WHERE user_id='me'").fetchone() == (1, 1, 90)
+    summary = pmg.get_study_summary(conn, "me")
+    assert summary["current_streak"] == 1
+    assert summary["minutes_per_section"] == 1.5
+
+def test_single_section_visit_is_timed_and_shown(monkeypatch, tmp_path):
+    from streamlit.testing.v1 import AppTest
+    from conftest import ROOT
+    os.makedirs(tmp_path / "data")
+    corpus = {"chapters": [{"url": "u", "title": "T", "sections": [{"heading": "H", "paragraphs": []}]}], "paragraphs": {}}
+    (tmp_path / "data" / "preach_my_gospel_db.json").write_text(json.dumps(corpus), encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    at = AppTest.from_file(os.path.join(ROOT, "pmg.py"), default_timeout=60)
+    at.run()
+    # The dashboard is rendered after the visit on screen has been recorded.
+    assert at.metric[0].value == "1 days"
+    at.run()
+    with sqlite3.connect(tmp_path / "data" / "progress.sqlite3") as conn:
+        views, seconds = conn.execute("SELECT views, seconds FROM study_chapter WHERE chapter_url='u'").fetchone()
+    assert views == 1
+    assert seconds > 0
+
+# === Load-test harness ===
+@pytest.mark.parametrize("values, pct, expected", [
+    ([], 50, 0.0),
+    ([7], 99, 7),
+    ([1, 2, 3, 4, 5], 50, 3),
+    ([1, 2, 3, 4], 50, 2),
+    ([5, 1, 4, 2, 3], 0, 1),
+    ([5, 1, 4, 2, 3], 100, 5),
+    (list(range(1, 101)), 95, 95),
+    (list(range(1, 101)), 99, 99),
+    (list(range(1, 21)), 95, 19),
+    (list(range(1, 21)), 99, 20),
+])
+def test_percentile_is_nearest_rank(loadtest, values, pct, expected):
+    assert loadtest.percentile(values, pct) == expected